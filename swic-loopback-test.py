@@ -2,14 +2,18 @@
 
 # Copyright 2019 RnD Center "ELVEES", JSC
 
+import errno
 import filecmp
 import itertools
 import math
 import os
 import random
 import re
+import select
+import statistics
 import subprocess
 import tempfile
+import threading
 import time
 import unittest
 
@@ -35,6 +39,51 @@ def stats_get(dev):
     return match
 
 
+def watch_link_state(dev, states):
+    # swic prints CLOCK_MONOTONIC timestamps, which is the clock of time.monotonic()
+    proc = subprocess.Popen(['swic', dev, '-w'], stdout=subprocess.PIPE)
+
+    def read_states():
+        for line in proc.stdout:
+            timestamp, state = line.decode('utf-8').split()
+            states.append((float(timestamp), state))
+
+    threading.Thread(target=read_states, daemon=True).start()
+
+    return proc
+
+
+def receive_first(dev, timestamps, stop):
+    fd = os.open(dev, os.O_RDWR)
+    poller = select.poll()
+    poller.register(fd, select.POLLIN)
+    try:
+        # Poll with short timeout instead of blocking read, so that the device is
+        # released once stop is set and does not swallow packets of later tests
+        while not stop.is_set():
+            if not poller.poll(10):
+                continue
+            try:
+                if os.read(fd, 1024*1024):
+                    timestamps.append(time.monotonic())
+                    return
+            except OSError as err:
+                if err.errno != errno.ENOLINK:
+                    raise
+                time.sleep(0.0001)
+    finally:
+        os.close(fd)
+
+
+def latency_summary(latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[min(len(latencies) - 1, math.ceil(0.95 * len(latencies)) - 1)]
+
+    return 'min {:.3f}, median {:.3f}, p95 {:.3f}, max {:.3f} ms'.format(
+        latencies[0] * 1000, statistics.median(latencies) * 1000, p95 * 1000,
+        latencies[-1] * 1000)
+
+
 class TestcaseSWIC(unittest.TestCase):
 
     @classmethod
@@ -324,6 +373,151 @@ class TestcaseSWIC(unittest.TestCase):
             with self.subTest(i=i):
                 self.check(self.speed, mtu, src, dst)
 
+    def wait_link_state(self, states, since, match):
+        started = time.monotonic()
+        while True:
+            # State in effect at the moment 'since' followed by later changes
+            changes = [(since, state) for timestamp, state in list(states)
+                       if timestamp < since][-1:]
+            changes += [(timestamp, state) for timestamp, state in list(states)
+                        if timestamp >= since]
+            for timestamp, state in changes:
+                if match(state):
+                    return timestamp
+            self.assertLess(time.monotonic() - started, self.timeout,
+                            'Timeout waiting for link state change')
+            time.sleep(0.001)
+
+    def send_until_received(self, dev, timestamps):
+        payload = rand_bytes(16)
+        started = time.monotonic()
+
+        fd = os.open(dev, os.O_RDWR)
+        try:
+            # Packets sent while link is still connecting can be lost, so keep sending
+            # until receiver gets one of them
+            while not timestamps:
+                try:
+                    os.write(fd, payload)
+                except OSError as err:
+                    if err.errno != errno.ENOLINK:
+                        raise
+                    time.sleep(0.0001)
+                self.assertLess(time.monotonic() - started, self.timeout,
+                                'Timeout waiting for data after link up')
+        finally:
+            os.close(fd)
+
+    @unittest.skipUnless(int(os.environ.get('BENCHMARK', 0)), 'set BENCHMARK=1 to run benchmarks')
+    def test_link_recovery(self):
+        speed_pool = [408, 360, 312, 264, 216, 168, 120, 72, 4.8, 2.4]
+        scenarios = ['/dev/spacewire0', '/dev/spacewire1', 'transfer']
+        mtu = 16 * 1024
+        src = '/dev/spacewire0'
+        dst = '/dev/spacewire1'
+        packets = math.ceil(self.filesize / mtu)
+
+        states = {src: [], dst: []}
+        watchers = [watch_link_state(dev, states[dev]) for dev in states]
+
+        try:
+            for speed in speed_pool:
+                self.run_procs([
+                    ['swic', src,
+                     '-m', str(mtu),
+                     '-s', str(speed)],
+                    ['swic', dst,
+                     '-m', str(mtu),
+                     '-s', str(speed)],
+                    ])
+                exch_time_s = self.filesize * 8 / (speed * 1000 * 1000)
+
+                for scenario in scenarios:
+                    run_latencies = []
+                    data_latencies = []
+
+                    for i in range(self.iters):
+                        for dev in states:
+                            self.wait_link_state(states[dev], time.monotonic(),
+                                                 lambda state: state == 'Run')
+
+                        brk_src = scenario
+                        procs = []
+                        if scenario == 'transfer':
+                            brk_src = random.choice([src, dst])
+                            procs = [subprocess.Popen(['swic-xfer', src, 's',
+                                                       '-f', self.inputfile],
+                                                      stderr=subprocess.DEVNULL),
+                                     subprocess.Popen(['swic-xfer', dst, 'r',
+                                                       '-f', self.outputfile,
+                                                       '-n', str(packets)],
+                                                      stderr=subprocess.DEVNULL)]
+                            time.sleep(random.random() * exch_time_s)
+
+                        down_time = time.monotonic()
+                        self.run_procs([['swic', brk_src, '-l', 'down']])
+                        for dev in states:
+                            self.wait_link_state(states[dev], down_time,
+                                                 lambda state: state != 'Run')
+
+                        for proc in procs:
+                            try:
+                                proc.wait(timeout=self.timeout)
+                            except subprocess.TimeoutExpired:
+                                proc.kill()
+                                proc.wait()
+
+                        # Drop packets of interrupted transfer, so that only new data is
+                        # counted as received after link up
+                        self.run_procs([['swic', dst, '-f']])
+
+                        rx_timestamps = []
+                        stop = threading.Event()
+                        receiver = threading.Thread(target=receive_first,
+                                                    args=(dst, rx_timestamps, stop))
+                        receiver.start()
+
+                        up_request = time.monotonic()
+                        try:
+                            self.run_procs([['swic', brk_src, '-l', 'up']])
+                            self.send_until_received(src, rx_timestamps)
+                        finally:
+                            stop.set()
+                            receiver.join()
+
+                        # Link up takes effect at the first state change of brk_src after
+                        # the command, which excludes spawning of swic from latencies
+                        down_state = [state for timestamp, state in list(states[brk_src])
+                                      if timestamp < up_request][-1]
+                        up_time = self.wait_link_state(states[brk_src], up_request,
+                                                       lambda state: state != down_state)
+
+                        run_time = max(self.wait_link_state(states[dev], up_time,
+                                                            lambda state: state == 'Run')
+                                       for dev in states)
+                        run_latencies.append(run_time - up_time)
+                        data_latencies.append(rx_timestamps[0] - up_time)
+
+                        if self.verbose:
+                            print('Speed {}, {} down, iteration {}: link run {:.3f} ms, '
+                                  'first byte {:.3f} ms'.format(speed, brk_src, i + 1,
+                                                                run_latencies[-1] * 1000,
+                                                                data_latencies[-1] * 1000))
+
+                        self.run_procs([['swic', dst, '-f']])
+
+                    print('\nSpeed {} Mbit/s, {} down'.format(
+                        speed, 'random side during transfer' if scenario == 'transfer'
+                        else scenario))
+                    print('  Link up to Run on both sides: {}'.format(
+                        latency_summary(run_latencies)))
+                    print('  Link up to first received byte: {}'.format(
+                        latency_summary(data_latencies)))
+        finally:
+            for proc in watchers:
+                proc.kill()
+                proc.wait()
+
     def test_full_duplex(self):
         mtu = 16 * 1024
 
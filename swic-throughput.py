@@ -7,6 +7,7 @@ import csv
 import math
 import os
 import re
+import resource
 import subprocess
 import sys
 
@@ -27,23 +28,41 @@ def save_log(dev, mode, throughput_app, total_time, tx_speed, mtu_list):
         writer.writerows(log)
 
 
-def save_info_to_file(filename, tx_speed, rx_speed, tm, mtu_list):
+def save_info_to_file(filename, tx_speed, rx_speed, tm, mtu_list, cpu_stats, extra=None,
+                      sizes=None, directions=1):
     info = []
+    extra = extra or {}
+    sizes = sizes or [filesize] * len(mtu_list)
 
     data_fieldnames = ['Transmitter TX speed, Mbit/s',
                        'Receiver TX speed, Mbit/s',
                        'Bytes, bytes',
                        'Time, s',
                        'Throughput, Mbit/s',
-                       'MTU, bytes']
+                       'MTU, bytes',
+                       'CPU time, s',
+                       'CPU utilization, %',
+                       'SWIC interrupts',
+                       'Context switches',
+                       'CPU-seconds per GB',
+                       'Interrupts per MB'] + list(extra)
 
     for i in range(len(mtu_list)):
+        # Bytes moved by all swic-xfer processes of a measurement, for CPU cost per byte
+        transferred = directions * sizes[i]
         info.append({'Transmitter TX speed, Mbit/s': tx_speed[i],
                      'Receiver TX speed, Mbit/s': rx_speed[i],
-                     'Bytes, bytes': filesize,
+                     'Bytes, bytes': sizes[i],
                      'Time, s': tm[i],
-                     'Throughput, Mbit/s': 8 * filesize / (float(tm[i]) * 1024*1024),
-                     'MTU, bytes': mtu_list[i]})
+                     'Throughput, Mbit/s': 8 * sizes[i] / (float(tm[i]) * 1024*1024),
+                     'MTU, bytes': mtu_list[i],
+                     'CPU time, s': cpu_stats[i]['cpu_time'],
+                     'CPU utilization, %': cpu_stats[i]['utilization'],
+                     'SWIC interrupts': cpu_stats[i]['irqs'],
+                     'Context switches': cpu_stats[i]['ctxt'],
+                     'CPU-seconds per GB': cpu_stats[i]['cpu_time'] / (transferred / 1024**3),
+                     'Interrupts per MB': cpu_stats[i]['irqs'] / (transferred / 1024**2)})
+        info[-1].update({name: values[i] for name, values in extra.items()})
 
     with open('/tmp/' + filename, 'w') as csv_file:
         writer = csv.DictWriter(csv_file, fieldnames=data_fieldnames)
@@ -51,6 +70,53 @@ def save_info_to_file(filename, tx_speed, rx_speed, tm, mtu_list):
         writer.writerows(info)
 
 
+def read_proc_stat():
+    # First line of /proc/stat is aggregate time of all CPUs in jiffies:
+    # cpu user nice system idle iowait irq softirq steal guest guest_nice
+    # guest and guest_nice are already included in user and nice, so they are skipped
+    with open('/proc/stat') as file_:
+        lines = file_.read().splitlines()
+
+    times = [int(x) for x in lines[0].split()[1:9]]
+    ctxt = next(int(line.split()[1]) for line in lines if line.startswith('ctxt '))
+
+    return {'busy': sum(times) - times[3] - times[4],
+            'total': sum(times),
+            'ctxt': ctxt}
+
+
+def read_swic_irqs():
+    irqs = 0
+
+    with open('/proc/interrupts') as file_:
+        num_cpus = len(file_.readline().split())
+        for line in file_:
+            if not re.search(swic_irq_regex, line):
+                continue
+            irqs += sum(int(x) for x in line.split()[1:num_cpus + 1])
+
+    return irqs
+
+
+def cpu_snapshot():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    snapshot = read_proc_stat()
+    snapshot['irqs'] = read_swic_irqs()
+    snapshot['cpu_time'] = usage.ru_utime + usage.ru_stime
+
+    return snapshot
+
+
+def cpu_stats_diff(before, after):
+    total = after['total'] - before['total']
+
+    return {'cpu_time': after['cpu_time'] - before['cpu_time'],
+            'utilization': 100 * (after['busy'] - before['busy']) / total if total else 0,
+            'irqs': after['irqs'] - before['irqs'],
+            'ctxt': after['ctxt'] - before['ctxt']}
+
+
 def run_procs(list_of_lists_of_args, verbose):
     stdouts = []
     process = []
@@ -74,9 +140,19 @@ def run_procs(list_of_lists_of_args, verbose):
     return stdouts
 
 
-def check(inputfile, outputfile, speed_tx, speed_rx, mtu, packets, stdouts):
-    with open(inputfile, 'wb') as fout:
-        fout.write(os.urandom(filesize))
+def check(transfers, speed_tx, speed_rx, mtu, packets, stdouts, cpu_stats,
+          tx_args=(), rx_args=(), size=None, tx_pipe=False):
+    """Run transfers given as (src, dst, inputfile, outputfile) concurrently.
+
+    spacewire0 is configured with speed_tx, spacewire1 with speed_rx. Returns
+    stdouts of transmitter and receiver of every transfer in turn.
+    """
+    size = size or filesize
+
+    for src, dst, inputfile, outputfile in transfers:
+        with open(inputfile, 'wb') as fout:
+            for offset in range(0, size, 1024*1024):
+                fout.write(os.urandom(min(1024*1024, size - offset)))
 
     run_procs([
         ['swic',
@@ -93,31 +169,80 @@ def check(inputfile, outputfile, speed_tx, speed_rx, mtu, packets, stdouts):
          ]
         ], verbose=args.v)
 
-    stdouts = run_procs([
-        ['swic-xfer',
-         '/dev/spacewire0',
-         's',
-         '-f', inputfile,
-         '-v'],
-        ['swic-xfer',
-         '/dev/spacewire1',
-         'r',
-         '-f', outputfile,
-         '-n', str(packets),
-         '-v'],
-        ], verbose=args.v)
+    rx_procs = []
+    tx_procs = []
+    for src, dst, inputfile, outputfile in transfers:
+        rx_procs.append(['swic-xfer',
+                         dst,
+                         'r',
+                         '-f', outputfile,
+                         '-n', str(packets),
+                         '-v', *rx_args])
+        tx_procs.append(['swic-xfer',
+                         src,
+                         's',
+                         '-f', inputfile,
+                         '-v', *tx_args])
+        if tx_pipe:
+            # Feed transmitter through stdin from a pipe, as with the video stream
+            tx_procs[-1] = ['sh', '-c', 'cat "$0" | exec "$@"', inputfile,
+                            'swic-xfer',
+                            src,
+                            's',
+                            '-v', *tx_args]
+
+    # Several transfers start all receivers before transmitters, so that they overlap.
+    # A single transfer keeps transmitter-then-receiver order of earlier measurements.
+    count = len(transfers)
+    if count > 1:
+        procs = rx_procs + tx_procs
+    else:
+        procs = tx_procs + rx_procs
+
+    # Resource usage of children is accounted only after they are waited for, so the
+    # difference covers exactly the swic-xfer processes started below
+    cpu_before = cpu_snapshot()
+    proc_stdouts = run_procs(procs, verbose=args.v)
+    cpu_stats.append(cpu_stats_diff(cpu_before, cpu_snapshot()))
 
     run_procs([
         ['swic', '--link', 'down', '/dev/spacewire0'],
         ['swic', '--link', 'down', '/dev/spacewire1'],
         ], verbose=args.v)
 
+    # Reorder to transmitter, receiver of every transfer
+    stdouts = []
+    for i in range(count):
+        tx_stdout = proc_stdouts[procs.index(tx_procs[i])]
+        rx_stdout = proc_stdouts[procs.index(rx_procs[i])]
+        stdouts += [tx_stdout, rx_stdout]
+
     if args.v:
         print('data exchange with tx_speed = {}, rx_speed = {}, mtu = {} is successful'
               .format(speed_tx, speed_rx, mtu))
+        print('CPU time {:.3f} s ({:.3f} s/GB), CPU utilization {:.1f} %, '
+              'SWIC interrupts {} ({:.1f} per MB), context switches {}'
+              .format(cpu_stats[-1]['cpu_time'],
+                      cpu_stats[-1]['cpu_time'] / (count * size / 1024**3),
+                      cpu_stats[-1]['utilization'],
+                      cpu_stats[-1]['irqs'],
+                      cpu_stats[-1]['irqs'] / (count * size / 1024**2),
+                      cpu_stats[-1]['ctxt']))
     return stdouts
 
 
+def transfer_window(stdouts):
+    # Window spans the first write of transmitters to the last read of receivers, both
+    # in CLOCK_MONOTONIC as printed by swic-xfer. First read of a receiver only starts
+    # waiting for data, so it is not used.
+    first = min(float(re.findall(r'First I/O timestamp: (\d+.\d+)', stdout.decode('utf-8'))[0])
+                for stdout in stdouts[0::2])
+    last = max(float(re.findall(r'Last I/O timestamp: (\d+.\d+)', stdout.decode('utf-8'))[0])
+               for stdout in stdouts[1::2])
+
+    return last - first
+
+
 def save_output_data(output1, output2, dev, mode, throughput_app, total_time, tm):
     for output in (output1, output2):
         total_time.append(re.findall(r'Total time: (\d+.\d+)', output)[0])
@@ -131,12 +256,42 @@ def save_output_data(output1, output2, dev, mode, throughput_app, total_time, tm
     dev.append(re.findall('Receiving device: (.+)', output2)[0])
 
 
+def fit_fixed_cost(sizes, times):
+    # Weighted least squares fit of time = fixed + size / bandwidth. Weights 1/time^2
+    # minimize relative error, so that short transfers which define the fixed cost are
+    # not swamped by the long ones
+    weights = [1 / t**2 for t in times]
+    sw = sum(weights)
+    sx = sum(w * x for w, x in zip(weights, sizes))
+    sy = sum(w * y for w, y in zip(weights, times))
+    sxx = sum(w * x * x for w, x in zip(weights, sizes))
+    sxy = sum(w * x * y for w, x, y in zip(weights, sizes, times))
+
+    denominator = sw * sxx - sx**2
+    if denominator == 0:
+        return None
+
+    slope = (sw * sxy - sx * sy) / denominator
+    if slope <= 0:
+        # Time does not grow with size, measurements are dominated by noise
+        return None
+
+    fixed = (sy - slope * sx) / sw
+    if fixed < 0:
+        # Negative fixed cost is not physical, refit with time = size / bandwidth
+        fixed = 0
+        slope = sxy / sxx
+
+    return fixed, 1 / slope
+
+
 def save_input_data(collections, values):
     for collect, value in zip(collections, values):
         collect.append(value)
 
 
-def test_speed(throughput_app, total_time, rx_speed, tx_speed, mtu_list, mode, dev, tm, stdouts):
+def test_speed(throughput_app, total_time, rx_speed, tx_speed, mtu_list, mode, dev, tm, stdouts,
+               cpu_stats):
     tx_speed_pool = [408, 120, 4.8]
     rx_speed_pool = [408, 360, 312, 264, 216, 168, 120, 72, 4.8, 2.4]
 
@@ -146,17 +301,19 @@ def test_speed(throughput_app, total_time, rx_speed, tx_speed, mtu_list, mode, d
         for speed_rx in rx_speed_pool:
             for i in range(num_msr):
                 save_input_data([tx_speed, rx_speed, mtu_list], [speed_tx, speed_rx, mtu])
-                stdouts = check(inputfile, outputfile, speed_tx, speed_rx, mtu, packets, stdouts)
+                stdouts = check(simplex_transfer, speed_tx, speed_rx, mtu, packets, stdouts,
+                                cpu_stats)
                 save_output_data(stdouts[0].decode("utf-8"),
                                  stdouts[1].decode("utf-8"),
                                  dev, mode, throughput_app,
                                  total_time, tm)
 
-    save_info_to_file("data-test-speed.csv", tx_speed, rx_speed, tm, mtu_list)
+    save_info_to_file("data-test-speed.csv", tx_speed, rx_speed, tm, mtu_list, cpu_stats)
     save_log(dev, mode, throughput_app, total_time, tx_speed, mtu_list)
 
 
-def test_mtu(throughput_app, total_time, rx_speed, tx_speed, mtu_list, mode, dev, tm, stdouts):
+def test_mtu(throughput_app, total_time, rx_speed, tx_speed, mtu_list, mode, dev, tm, stdouts,
+             cpu_stats):
     tx_speed_pool = [408, 120, 4.8]
     speed_rx = 408
     mtu_pool = [128, 512, 1024,  5120, 10240, 16384]
@@ -167,29 +324,239 @@ def test_mtu(throughput_app, total_time, rx_speed, tx_speed, mtu_list, mode, dev
                 packets = math.ceil(filesize / mtu)
 
                 save_input_data([tx_speed, rx_speed, mtu_list], [speed_tx, speed_rx, mtu])
-                stdouts = check(inputfile, outputfile, speed_tx, speed_rx, mtu, packets, stdouts)
+                stdouts = check(simplex_transfer, speed_tx, speed_rx, mtu, packets, stdouts,
+                                cpu_stats)
+                save_output_data(stdouts[0].decode("utf-8"),
+                                 stdouts[1].decode("utf-8"),
+                                 dev, mode, throughput_app,
+                                 total_time, tm)
+
+    save_info_to_file("data-test-mtu.csv", tx_speed, rx_speed, tm, mtu_list, cpu_stats)
+    save_log(dev, mode, throughput_app, total_time, tx_speed, mtu_list)
+
+
+def test_rx_buffering(throughput_app, total_time, rx_speed, tx_speed, mtu_list, mode, dev, tm,
+                      stdouts, cpu_stats):
+    speed_tx = 408
+    speed_rx = 408
+    mtu_pool = [128, 512, 1024,  5120, 10240, 16384]
+    rx_mode_pool = {'per-packet': [],
+                    'buffered': ['-b', str(4*1024*1024)],
+                    'mmap': ['-p', str(filesize)]}
+    rx_mode = []
+    rx_total_time = []
+    rx_throughput = []
+
+    for mtu in mtu_pool:
+        for name, rx_args in rx_mode_pool.items():
+            for i in range(num_msr):
+                packets = math.ceil(filesize / mtu)
+
+                save_input_data([tx_speed, rx_speed, mtu_list, rx_mode],
+                                [speed_tx, speed_rx, mtu, name])
+                stdouts = check(simplex_transfer, speed_tx, speed_rx, mtu, packets, stdouts,
+                                cpu_stats, rx_args=rx_args)
                 save_output_data(stdouts[0].decode("utf-8"),
                                  stdouts[1].decode("utf-8"),
                                  dev, mode, throughput_app,
                                  total_time, tm)
 
-    save_info_to_file("data-test-mtu.csv", tx_speed, rx_speed, tm, mtu_list)
+                # Receiver total time includes writing to file, unlike elapsed time of reads
+                rx_total_time.append(total_time[-1])
+                rx_throughput.append(8 * filesize / (float(total_time[-1]) * 1024*1024))
+
+    save_info_to_file("data-test-rx-buffering.csv", tx_speed, rx_speed, tm, mtu_list, cpu_stats,
+                      {'RX mode': rx_mode,
+                       'Receiver total time, s': rx_total_time,
+                       'Receiver throughput, Mbit/s': rx_throughput})
+    save_log(dev, mode, throughput_app, total_time, tx_speed, mtu_list)
+
+
+def test_tx_buffering(throughput_app, total_time, rx_speed, tx_speed, mtu_list, mode, dev, tm,
+                      stdouts, cpu_stats):
+    speed_tx = 408
+    speed_rx = 408
+    mtu_pool = [128, 512, 1024,  5120, 10240, 16384]
+    # Mode name: swic-xfer options, whether input is fed through a pipe
+    tx_mode_pool = {'stdio': ([], False),
+                    'mmap': (['-M'], False),
+                    'ring': (['-R', '4'], False),
+                    'stdio-pipe': ([], True),
+                    'ring-pipe': (['-R', '4'], True)}
+    tx_mode = []
+    tx_total_time = []
+    tx_throughput = []
+
+    for mtu in mtu_pool:
+        for name, (tx_args, tx_pipe) in tx_mode_pool.items():
+            for i in range(num_msr):
+                packets = math.ceil(filesize / mtu)
+
+                save_input_data([tx_speed, rx_speed, mtu_list, tx_mode],
+                                [speed_tx, speed_rx, mtu, name])
+                stdouts = check(simplex_transfer, speed_tx, speed_rx, mtu, packets, stdouts,
+                                cpu_stats, tx_args=tx_args, tx_pipe=tx_pipe)
+                save_output_data(stdouts[0].decode("utf-8"),
+                                 stdouts[1].decode("utf-8"),
+                                 dev, mode, throughput_app,
+                                 total_time, tm)
+
+                # Transmitter total time includes reading of file, unlike elapsed time of writes
+                tx_total_time.append(total_time[-2])
+                tx_throughput.append(8 * filesize / (float(total_time[-2]) * 1024*1024))
+
+    save_info_to_file("data-test-tx-buffering.csv", tx_speed, rx_speed, tm, mtu_list, cpu_stats,
+                      {'TX mode': tx_mode,
+                       'Transmitter total time, s': tx_total_time,
+                       'Transmitter throughput, Mbit/s': tx_throughput})
+    save_log(dev, mode, throughput_app, total_time, tx_speed, mtu_list)
+
+
+def test_duplex(throughput_app, total_time, rx_speed, tx_speed, mtu_list, mode, dev, tm,
+                stdouts, cpu_stats):
+    speed_pool = [408, 120, 4.8]
+    mtu_pool = [128, 512, 1024,  5120, 10240, 16384]
+    duplex_transfer = simplex_transfer + [('/dev/spacewire1', '/dev/spacewire0',
+                                           '/tmp/input-reverse.bin',
+                                           '/tmp/output-reverse.bin')]
+    reverse_tm = []
+    reverse_throughput = []
+    aggregate_throughput = []
+    simplex_throughput = []
+    shortfall = []
+
+    for speed in speed_pool:
+        for mtu in mtu_pool:
+            for i in range(num_msr):
+                packets = math.ceil(filesize / mtu)
+
+                # Simplex reference spacewire0 -> spacewire1 with the same settings
+                stdouts = check(simplex_transfer, speed, speed, mtu, packets, stdouts, [])
+                simplex_window = transfer_window(stdouts)
+
+                save_input_data([tx_speed, rx_speed, mtu_list], [speed, speed, mtu])
+                stdouts = check(duplex_transfer, speed, speed, mtu, packets, stdouts, cpu_stats)
+                duplex_window = transfer_window(stdouts)
+                save_output_data(stdouts[0].decode("utf-8"),
+                                 stdouts[1].decode("utf-8"),
+                                 dev, mode, throughput_app,
+                                 total_time, tm)
+                save_output_data(stdouts[2].decode("utf-8"),
+                                 stdouts[3].decode("utf-8"),
+                                 dev, mode, throughput_app,
+                                 total_time, reverse_tm)
+
+                # Per-direction rates come from read time of each receiver, while simplex and
+                # aggregate rates use wall-clock window of all transfers of a measurement
+                forward = 8 * filesize / (float(tm[-1]) * 1024*1024)
+                reverse = 8 * filesize / (float(reverse_tm[-1]) * 1024*1024)
+                aggregate = 8 * 2 * filesize / (duplex_window * 1024*1024)
+                simplex = 8 * filesize / (simplex_window * 1024*1024)
+
+                reverse_throughput.append(reverse)
+                aggregate_throughput.append(aggregate)
+                simplex_throughput.append(simplex)
+                shortfall.append(100 * (1 - aggregate / (2 * simplex)))
+
+                if args.v:
+                    print('Duplex {:.1f} and {:.1f}, aggregate {:.1f} Mbit/s, simplex {:.1f} '
+                          'Mbit/s, {:.1f} % short of twice simplex'
+                          .format(forward, reverse, aggregate, simplex, shortfall[-1]))
+
+    save_info_to_file("data-test-duplex.csv", tx_speed, rx_speed, tm, mtu_list, cpu_stats,
+                      {'Reverse time, s': reverse_tm,
+                       'Reverse throughput, Mbit/s': reverse_throughput,
+                       'Aggregate throughput, Mbit/s': aggregate_throughput,
+                       'Simplex throughput, Mbit/s': simplex_throughput,
+                       'Shortfall from twice simplex, %': shortfall},
+                      directions=2)
     save_log(dev, mode, throughput_app, total_time, tx_speed, mtu_list)
 
+    for src, dst, inputfile_, outputfile_ in duplex_transfer[1:]:
+        os.remove(inputfile_)
+        os.remove(outputfile_)
+
+
+def test_size_sweep(throughput_app, total_time, rx_speed, tx_speed, mtu_list, mode, dev, tm,
+                    stdouts, cpu_stats):
+    # Speed pool of other tests without 4.8 Mbit/s, where transfers up to default maximum
+    # size take about 7 minutes each
+    speed_pool = [408, 120]
+    mtu_pool = [128, 512, 1024,  5120, 10240, 16384]
+    sizes = []
+    tx_total_time = []
+    fits = []
+    sweep_transfer = [('/dev/spacewire0', '/dev/spacewire1',
+                       os.path.join(args.sweep_dir, 'input-sweep.bin'),
+                       os.path.join(args.sweep_dir, 'output-sweep.bin'))]
+
+    for speed in speed_pool:
+        for mtu in mtu_pool:
+            # From a single packet up to maximum size in steps of 4x
+            size_pool = [mtu]
+            while size_pool[-1] * 4 <= max_size or len(size_pool) < 2:
+                size_pool.append(size_pool[-1] * 4)
+
+            for size in size_pool:
+                for i in range(num_msr):
+                    packets = math.ceil(size / mtu)
+
+                    save_input_data([tx_speed, rx_speed, mtu_list, sizes],
+                                    [speed, speed, mtu, size])
+                    stdouts = check(sweep_transfer, speed, speed, mtu, packets, stdouts,
+                                    cpu_stats, size=size)
+                    save_output_data(stdouts[0].decode("utf-8"),
+                                     stdouts[1].decode("utf-8"),
+                                     dev, mode, throughput_app,
+                                     total_time, tm)
+
+                    # Transmitter total time includes opening and setup of transfer
+                    tx_total_time.append(float(total_time[-2]))
+
+            count = len(size_pool) * num_msr
+            fit = fit_fixed_cost(sizes[-count:], tx_total_time[-count:])
+            if fit is None:
+                print('Warning: no fit for speed = {}, mtu = {}, transfer time does not grow '
+                      'with size'.format(speed, mtu), file=sys.stderr)
+                fixed, bandwidth = math.nan, math.nan
+            else:
+                fixed, bandwidth = fit
+
+            fits.append({'TX speed, Mbit/s': speed,
+                         'MTU, bytes': mtu,
+                         'Fixed time, s': fixed,
+                         'Asymptotic throughput, Mbit/s': 8 * bandwidth / (1024*1024),
+                         # size / (fixed + size / bandwidth) = k * bandwidth
+                         'Size for 50% throughput, bytes': fixed * bandwidth,
+                         'Size for 90% throughput, bytes': 9 * fixed * bandwidth})
+
+            if args.v:
+                print('Speed {}, mtu {}: fixed time {:.6f} s, asymptotic throughput '
+                      '{:.1f} Mbit/s, 50% at {:.0f} bytes, 90% at {:.0f} bytes'
+                      .format(speed, mtu, fixed, 8 * bandwidth / (1024*1024),
+                              fixed * bandwidth, 9 * fixed * bandwidth))
+
+    save_info_to_file("data-test-size-sweep.csv", tx_speed, rx_speed, tm, mtu_list, cpu_stats,
+                      {'Transmitter total time, s': tx_total_time},
+                      sizes=sizes)
+    save_log(dev, mode, throughput_app, total_time, tx_speed, mtu_list)
+
+    with open('/tmp/data-test-size-sweep-fit.csv', 'w') as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=list(fits[0]))
+        writer.writeheader()
+        writer.writerows(fits)
+
+    for src, dst, inputfile_, outputfile_ in sweep_transfer:
+        os.remove(inputfile_)
+        os.remove(outputfile_)
+
 
 if __name__ == '__main__':
-    throughput_app = []
-    total_time = []
-    rx_speed = []
-    tx_speed = []
-    mtu_list = []
-    mode = []
-    dev = []
-    tm = []
     stdouts = [None, None]
 
     outputfile = '/tmp/output.bin'
     inputfile = '/tmp/input.bin'
+    simplex_transfer = [('/dev/spacewire0', '/dev/spacewire1', inputfile, outputfile)]
 
     log_fieldnames = ['Device',
                       'Mode',
@@ -198,33 +565,54 @@ if __name__ == '__main__':
                       'TX speed, Mbit/s',
                       'MTU, bytes']
 
+    tests = {'speed': test_speed,
+             'mtu': test_mtu,
+             'rx-buffering': test_rx_buffering,
+             'tx-buffering': test_tx_buffering,
+             'duplex': test_duplex,
+             'size-sweep': test_size_sweep}
+
     parser = argparse.ArgumentParser()
-    parser.add_argument('-i', help='input_file_size', default=1024*1024)
-    parser.add_argument('-n', help='number_of_measurements', default=2)
-    parser.add_argument('-m', help='mtu', default=1024*1024)
+    parser.add_argument('-i', help='input_file_size', type=int, default=1024*1024)
+    parser.add_argument('-n', help='number_of_measurements', type=int, default=2)
+    parser.add_argument('-m', help='mtu', type=int, default=1024*1024)
     parser.add_argument('-v', help='enable debug info')
+    parser.add_argument('--irq', help='regex of SWIC names in /proc/interrupts',
+                        default='swic|spacewire')
+    parser.add_argument('--max-size', help='maximum transfer size of size sweep', type=int,
+                        default=256*1024*1024)
+    parser.add_argument('--sweep-dir', help='directory for input and output files of size '
+                        'sweep, each up to maximum size; /tmp may be tmpfs in RAM',
+                        default='/tmp')
+    parser.add_argument('--tests', help='tests to run', nargs='+', choices=tests,
+                        default=['speed', 'mtu'])
 
     args = parser.parse_args()
     num_msr = args.n
     filesize = args.i
     mtu = args.m
+    max_size = args.max_size
+    swic_irq_regex = re.compile(args.irq, re.IGNORECASE)
 
     with open('/tmp/log.csv', 'w') as csv_file:
         writer = csv.DictWriter(csv_file, fieldnames=log_fieldnames)
         writer.writeheader()
 
-    test_speed(throughput_app, total_time, rx_speed, tx_speed, mtu_list, mode, dev, tm, stdouts)
-
-    throughput_app = []
-    total_time = []
-    rx_speed = []
-    tx_speed = []
-    mtu_list = []
-    mode = []
-    dev = []
-    tm = []
-
-    test_mtu(throughput_app, total_time, rx_speed, tx_speed, mtu_list, mode, dev, tm, stdouts)
-
-    os.remove(inputfile)
-    os.remove(outputfile)
+    for test in args.tests:
+        throughput_app = []
+        total_time = []
+        rx_speed = []
+        tx_speed = []
+        mtu_list = []
+        mode = []
+        dev = []
+        tm = []
+        cpu_stats = []
+
+        tests[test](throughput_app, total_time, rx_speed, tx_speed, mtu_list, mode, dev, tm,
+                    stdouts, cpu_stats)
+
+    # Size sweep alone uses its own files
+    for filename in (inputfile, outputfile):
+        if os.path.exists(filename):
+            os.remove(filename)
@@ -10,12 +10,16 @@
 #include <error.h>
 #include <fcntl.h>
 #include <math.h>
+#include <pthread.h>
+#include <signal.h>
 #include <stdint.h>
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
 #include <sys/ioctl.h>
+#include <sys/mman.h>
 #include <sys/stat.h>
+#include <sys/time.h>
 #include <time.h>
 #include <unistd.h>
 
@@ -28,21 +32,72 @@ struct elvees_swic_speed speed;
 int packets = -1;
 int verbose = 0;
 
+/* Receive batching: 0 means write and flush every packet */
+size_t rx_buf_size = 0;
+int rx_flush_ms = -1;
+off_t rx_prealloc_size = 0;
+
+/* Set by SIGALRM of flush interval timer */
+static volatile sig_atomic_t rx_flush_pending = 0;
+
+/* Send path: map input file or read it ahead into ring of MTU sized slots */
+int tx_mmap = 0;
+int tx_ring_slots = 0;
+
 enum operation_type {
     SWIC_WRITE,
     SWIC_READ
 };
 
-static void swic_write(int fd, FILE *file)
+static uint64_t timespec_diff_us(const struct timespec *start, const struct timespec *stop)
+{
+    return (stop->tv_sec * 1000000 + stop->tv_nsec / 1000) -
+           (start->tv_sec * 1000000 + start->tv_nsec / 1000);
+}
+
+/* CLOCK_MONOTONIC bounds of data transfer: start of first and end of last I/O */
+static struct timespec io_first, io_last;
+static int io_started = 0;
+
+static void io_mark(const struct timespec *start, const struct timespec *stop)
+{
+    if (!io_started) {
+        io_first = *start;
+        io_started = 1;
+    }
+    io_last = *stop;
+}
+
+static void print_io_bounds(void)
+{
+    print_verbose("First I/O timestamp: %ld.%06ld s\n", (long)io_first.tv_sec,
+                  io_first.tv_nsec / 1000);
+    print_verbose("Last I/O timestamp: %ld.%06ld s\n", (long)io_last.tv_sec,
+                  io_last.tv_nsec / 1000);
+}
+
+static void swic_write_packet(int fd, const void *buf, size_t bytes, uint64_t *elapsed_time)
 {
-    ssize_t written, transmitted = 0;
     struct timespec start, stop;
-    uint64_t elapsed_time = 0;
-    size_t bytes;
-    int mtu;
+    ssize_t written;
 
-    if (ioctl(fd, SWICIOC_GET_MTU, &mtu))
-        error(EXIT_FAILURE, errno, "%s: Failed to get MTU", __func__);
+    clock_gettime(CLOCK_MONOTONIC, &start);
+    written = write(fd, buf, bytes);
+    clock_gettime(CLOCK_MONOTONIC, &stop);
+
+    if (errno == ENOLINK)
+        error(EXIT_FAILURE, errno, "%s: Link is not set", __func__);
+    else if (written != bytes)
+        error(EXIT_FAILURE, 0, "Failed to write data to device");
+
+    *elapsed_time += timespec_diff_us(&start, &stop);
+    io_mark(&start, &stop);
+}
+
+static ssize_t swic_write_stdio(int fd, FILE *file, int mtu, uint64_t *elapsed_time)
+{
+    ssize_t transmitted = 0;
+    size_t bytes;
 
     void *tx_data = malloc(mtu);
     if (!tx_data)
@@ -56,24 +111,189 @@ static void swic_write(int fd, FILE *file)
         if (bytes == 0)
             break;
 
-        clock_gettime(CLOCK_MONOTONIC, &start);
-        written = write(fd, tx_data, bytes);
-        clock_gettime(CLOCK_MONOTONIC, &stop);
+        swic_write_packet(fd, tx_data, bytes, elapsed_time);
+        transmitted += bytes;
 
-        if (errno == ENOLINK)
-            error(EXIT_FAILURE, errno, "%s: Link is not set", __func__);
-        else if (written != bytes)
-            error(EXIT_FAILURE, 0, "Failed to write data to device");
+        if (packets != -1 && --packets == 0)
+            break;
+    }
 
-        transmitted += written;
+    free(tx_data);
 
-        elapsed_time += (stop.tv_sec * 1000000 + stop.tv_nsec  / 1000) -
-                        (start.tv_sec * 1000000 + start.tv_nsec / 1000);
+    return transmitted;
+}
+
+static ssize_t swic_write_mmap(int fd, FILE *file, int mtu, uint64_t *elapsed_time)
+{
+    struct stat filestatus;
+    off_t offset = 0;
+    size_t bytes;
+
+    if (fstat(fileno(file), &filestatus) == -1)
+        error(EXIT_FAILURE, errno, "%s: Failed to get file status", __func__);
+    if (!S_ISREG(filestatus.st_mode))
+        error(EXIT_FAILURE, 0, "%s: Mapping requires regular input file", __func__);
+    if (filestatus.st_size == 0)
+        return 0;
+
+    uint8_t *tx_data = mmap(NULL, filestatus.st_size, PROT_READ, MAP_PRIVATE,
+                            fileno(file), 0);
+    if (tx_data == MAP_FAILED)
+        error(EXIT_FAILURE, errno, "%s: Failed to map input file", __func__);
+    /* Advice values are not flags, so they are given one by one */
+    if (madvise(tx_data, filestatus.st_size, MADV_SEQUENTIAL))
+        error(0, errno, "%s: Failed to advise sequential access", __func__);
+    if (madvise(tx_data, filestatus.st_size, MADV_WILLNEED))
+        error(0, errno, "%s: Failed to advise read-ahead", __func__);
+
+    while (offset < filestatus.st_size) {
+        bytes = filestatus.st_size - offset;
+        if (bytes > mtu)
+            bytes = mtu;
+
+        swic_write_packet(fd, tx_data + offset, bytes, elapsed_time);
+        offset += bytes;
 
         if (packets != -1 && --packets == 0)
             break;
     }
 
+    munmap(tx_data, filestatus.st_size);
+
+    return offset;
+}
+
+struct tx_ring {
+    pthread_mutex_t lock;
+    pthread_cond_t filled;
+    pthread_cond_t drained;
+    FILE *file;
+    int mtu;
+    int slots;
+    int count;
+    int eof;
+    uint8_t *data;
+    size_t *bytes;
+};
+
+static void tx_ring_unlock(void *arg)
+{
+    pthread_mutex_unlock(arg);
+}
+
+/* Fill ring slots with MTU sized chunks of input while device sends previous ones */
+static void *tx_ring_reader(void *arg)
+{
+    struct tx_ring *ring = arg;
+    size_t bytes;
+    int head = 0;
+
+    while (1) {
+        pthread_mutex_lock(&ring->lock);
+        pthread_cleanup_push(tx_ring_unlock, &ring->lock);
+        while (ring->count == ring->slots)
+            pthread_cond_wait(&ring->drained, &ring->lock);
+        pthread_cleanup_pop(1);
+
+        bytes = fread(ring->data + (size_t)head * ring->mtu, 1, ring->mtu, ring->file);
+        if (ferror(ring->file))
+            error(EXIT_FAILURE, errno, "Failed to read data from file");
+
+        pthread_mutex_lock(&ring->lock);
+        if (bytes == 0) {
+            ring->eof = 1;
+        } else {
+            ring->bytes[head] = bytes;
+            ring->count++;
+        }
+        pthread_cond_signal(&ring->filled);
+        pthread_mutex_unlock(&ring->lock);
+
+        if (bytes == 0)
+            break;
+
+        head = (head + 1) % ring->slots;
+    }
+
+    return NULL;
+}
+
+static ssize_t swic_write_ring(int fd, FILE *file, int mtu, uint64_t *elapsed_time)
+{
+    struct tx_ring ring = {
+        .lock = PTHREAD_MUTEX_INITIALIZER,
+        .filled = PTHREAD_COND_INITIALIZER,
+        .drained = PTHREAD_COND_INITIALIZER,
+        .file = file,
+        .mtu = mtu,
+        .slots = tx_ring_slots,
+    };
+    ssize_t transmitted = 0;
+    pthread_t reader;
+    int tail = 0;
+    int ret;
+
+    ring.data = malloc((size_t)ring.slots * mtu);
+    ring.bytes = calloc(ring.slots, sizeof(*ring.bytes));
+    if (!ring.data || !ring.bytes)
+        error(EXIT_FAILURE, 0, "%s: Failed to allocate memory", __func__);
+
+    ret = pthread_create(&reader, NULL, tx_ring_reader, &ring);
+    if (ret)
+        error(EXIT_FAILURE, ret, "%s: Failed to create reader thread", __func__);
+
+    while (1) {
+        pthread_mutex_lock(&ring.lock);
+        while (!ring.count && !ring.eof)
+            pthread_cond_wait(&ring.filled, &ring.lock);
+        if (!ring.count) {
+            pthread_mutex_unlock(&ring.lock);
+            break;
+        }
+        pthread_mutex_unlock(&ring.lock);
+
+        /* Slot is owned by this thread until count is decremented */
+        swic_write_packet(fd, ring.data + (size_t)tail * mtu, ring.bytes[tail],
+                          elapsed_time);
+        transmitted += ring.bytes[tail];
+
+        pthread_mutex_lock(&ring.lock);
+        ring.count--;
+        pthread_cond_signal(&ring.drained);
+        pthread_mutex_unlock(&ring.lock);
+
+        tail = (tail + 1) % ring.slots;
+
+        if (packets != -1 && --packets == 0) {
+            pthread_cancel(reader);
+            break;
+        }
+    }
+
+    pthread_join(reader, NULL);
+
+    free(ring.bytes);
+    free(ring.data);
+
+    return transmitted;
+}
+
+static void swic_write(int fd, FILE *file)
+{
+    uint64_t elapsed_time = 0;
+    ssize_t transmitted;
+    int mtu;
+
+    if (ioctl(fd, SWICIOC_GET_MTU, &mtu))
+        error(EXIT_FAILURE, errno, "%s: Failed to get MTU", __func__);
+
+    if (tx_mmap)
+        transmitted = swic_write_mmap(fd, file, mtu, &elapsed_time);
+    else if (tx_ring_slots)
+        transmitted = swic_write_ring(fd, file, mtu, &elapsed_time);
+    else
+        transmitted = swic_write_stdio(fd, file, mtu, &elapsed_time);
+
     if (ioctl(fd, SWICIOC_GET_SPEED, &speed))
         error(EXIT_FAILURE, errno, "%s: Failed to get device speed", __func__);
 
@@ -85,46 +305,232 @@ static void swic_write(int fd, FILE *file)
     print_verbose("Transfered elapsed time: %f s\n", (double)elapsed_time / 1000000);
     print_verbose("Throughput of transmit: %f Mbit/s\n",
                   8 * (double)transmitted / (double)elapsed_time);
+    print_io_bounds();
+}
 
-    free(tx_data);
+static ssize_t swic_read_packet(int fd, void *buf, size_t size, uint64_t *elapsed_time)
+{
+    struct timespec start, stop;
+    ssize_t read_bytes;
+
+    clock_gettime(CLOCK_MONOTONIC, &start);
+    read_bytes = read(fd, buf, size);
+    clock_gettime(CLOCK_MONOTONIC, &stop);
+
+    *elapsed_time += timespec_diff_us(&start, &stop);
+
+    /* Interrupted by flush interval timer */
+    if (read_bytes < 0 && errno == EINTR)
+        return -1;
+
+    if (errno == ENOLINK)
+        error(EXIT_FAILURE, errno, "%s: Link is not set", __func__);
+    else if (read_bytes <= 0)
+        error(EXIT_FAILURE, errno, "Failed to read data from device");
+
+    io_mark(&start, &stop);
+
+    return read_bytes;
 }
 
-static void swic_read(int fd, FILE *file)
+static void swic_flush(FILE *file, const void *buf, size_t bytes)
+{
+    if (fwrite(buf, 1, bytes, file) != bytes)
+        error(EXIT_FAILURE, errno, "Failed to write data to file");
+    if (fflush(file))
+        error(EXIT_FAILURE, errno, "Failed to flush file");
+}
+
+static void rx_flush_alarm(int signum)
+{
+    rx_flush_pending = 1;
+}
+
+/*
+ * Periodic timer interrupts blocking read() with EINTR, so that buffered data
+ * is flushed in time without extra syscalls per packet
+ */
+static void rx_flush_timer_start(void)
+{
+    struct sigaction sa = { .sa_handler = rx_flush_alarm };
+    struct itimerval timer = {
+        .it_interval = { rx_flush_ms / 1000, (rx_flush_ms % 1000) * 1000 },
+        .it_value = { rx_flush_ms / 1000, (rx_flush_ms % 1000) * 1000 },
+    };
+
+    /* No SA_RESTART, read() must return on timer expiration */
+    sigemptyset(&sa.sa_mask);
+    if (sigaction(SIGALRM, &sa, NULL))
+        error(EXIT_FAILURE, errno, "%s: Failed to set signal handler", __func__);
+    if (setitimer(ITIMER_REAL, &timer, NULL))
+        error(EXIT_FAILURE, errno, "%s: Failed to start flush timer", __func__);
+}
+
+static void rx_flush_timer_stop(void)
+{
+    struct itimerval timer = { 0 };
+
+    if (setitimer(ITIMER_REAL, &timer, NULL))
+        error(EXIT_FAILURE, errno, "%s: Failed to stop flush timer", __func__);
+}
+
+/* Write buffered data with SIGALRM blocked, so that the timer does not interrupt it */
+static void swic_flush_buffered(FILE *file, const void *buf, size_t bytes)
+{
+    sigset_t alarm, old;
+
+    sigemptyset(&alarm);
+    sigaddset(&alarm, SIGALRM);
+
+    sigprocmask(SIG_BLOCK, &alarm, &old);
+    swic_flush(file, buf, bytes);
+    sigprocmask(SIG_SETMASK, &old, NULL);
+}
+
+static ssize_t swic_read_unbuffered(int fd, FILE *file, uint64_t *elapsed_time)
 {
     ssize_t read_bytes, sum_bytes = 0;
-    struct timespec start, stop;
-    uint64_t elapsed_time = 0;
-    size_t written = 0;
 
     void *rx_data = malloc(ELVEES_SWIC_MAX_PACKET_SIZE);
     if (!rx_data)
         error(EXIT_FAILURE, 0, "%s: Failed to allocate memory", __func__);
 
     while (1) {
-        clock_gettime(CLOCK_MONOTONIC, &start);
-        read_bytes = read(fd, rx_data, ELVEES_SWIC_MAX_PACKET_SIZE);
-        clock_gettime(CLOCK_MONOTONIC, &stop);
-
+        read_bytes = swic_read_packet(fd, rx_data, ELVEES_SWIC_MAX_PACKET_SIZE,
+                                      elapsed_time);
         sum_bytes += read_bytes;
 
-        elapsed_time += (stop.tv_sec * 1000000 + stop.tv_nsec  / 1000) -
-                        (start.tv_sec * 1000000 + start.tv_nsec / 1000);
+        swic_flush(file, rx_data, read_bytes);
+
+        if (packets != -1 && --packets == 0)
+            break;
+    }
+
+    free(rx_data);
+
+    return sum_bytes;
+}
+
+static ssize_t swic_read_buffered(int fd, FILE *file, uint64_t *elapsed_time)
+{
+    ssize_t read_bytes, sum_bytes = 0;
+    size_t fill = 0;
+
+    /* Room for one more maximum sized packet above the flush threshold */
+    uint8_t *rx_data = malloc(rx_buf_size + ELVEES_SWIC_MAX_PACKET_SIZE);
+    if (!rx_data)
+        error(EXIT_FAILURE, 0, "%s: Failed to allocate memory", __func__);
+
+    if (rx_flush_ms > 0)
+        rx_flush_timer_start();
+
+    while (1) {
+        read_bytes = swic_read_packet(fd, rx_data + fill, ELVEES_SWIC_MAX_PACKET_SIZE,
+                                      elapsed_time);
+        if (read_bytes > 0) {
+            sum_bytes += read_bytes;
+            fill += read_bytes;
+
+            if (packets != -1 && --packets == 0)
+                break;
+        }
+
+        /*
+         * Timer expiring just before read() is noticed on the next expiration,
+         * so buffered data is flushed within two flush intervals
+         */
+        if (fill >= rx_buf_size || (rx_flush_pending && fill)) {
+            swic_flush_buffered(file, rx_data, fill);
+            fill = 0;
+        }
+        rx_flush_pending = 0;
+    }
+
+    if (rx_flush_ms > 0)
+        rx_flush_timer_stop();
 
-        if (errno == ENOLINK)
-            error(EXIT_FAILURE, errno, "%s: Link is not set", __func__);
-        else if (read_bytes == 0)
-            error(EXIT_FAILURE, errno, "Failed to read data from device");
+    swic_flush(file, rx_data, fill);
 
-        written = fwrite(rx_data, 1, read_bytes, file);
-        fflush(file);
+    free(rx_data);
 
-        if (written != read_bytes)
-            error(EXIT_FAILURE, errno, "Failed to write data to file");
+    return sum_bytes;
+}
+
+static ssize_t swic_read_mmap(int fd, FILE *file, uint64_t *elapsed_time)
+{
+    int out_fd = fileno(file);
+    uint8_t *bounce = NULL;
+    ssize_t read_bytes;
+    off_t offset = 0;
+    int overflow = 0;
+    size_t size;
+    int ret;
+
+    ret = posix_fallocate(out_fd, 0, rx_prealloc_size);
+    if (ret)
+        error(EXIT_FAILURE, ret, "%s: Failed to preallocate output file", __func__);
+
+    uint8_t *rx_data = mmap(NULL, rx_prealloc_size, PROT_READ | PROT_WRITE, MAP_SHARED,
+                            out_fd, 0);
+    if (rx_data == MAP_FAILED)
+        error(EXIT_FAILURE, errno, "%s: Failed to map output file", __func__);
+
+    /* Receive until the requested number of packets or until the file is full */
+    while (offset < rx_prealloc_size) {
+        size = rx_prealloc_size - offset;
+        if (size >= ELVEES_SWIC_MAX_PACKET_SIZE) {
+            offset += swic_read_packet(fd, rx_data + offset, ELVEES_SWIC_MAX_PACKET_SIZE,
+                                       elapsed_time);
+        } else {
+            /*
+             * Read the tail through bounce buffer, so that a packet larger than
+             * the space left is detected instead of silently truncated
+             */
+            if (!bounce) {
+                bounce = malloc(ELVEES_SWIC_MAX_PACKET_SIZE);
+                if (!bounce)
+                    error(EXIT_FAILURE, 0, "%s: Failed to allocate memory", __func__);
+            }
+
+            read_bytes = swic_read_packet(fd, bounce, ELVEES_SWIC_MAX_PACKET_SIZE,
+                                          elapsed_time);
+            if (read_bytes > size) {
+                overflow = 1;
+                break;
+            }
+            memcpy(rx_data + offset, bounce, read_bytes);
+            offset += read_bytes;
+        }
 
         if (packets != -1 && --packets == 0)
             break;
     }
 
+    free(bounce);
+    munmap(rx_data, rx_prealloc_size);
+
+    if (ftruncate(out_fd, offset))
+        error(EXIT_FAILURE, errno, "%s: Failed to truncate output file", __func__);
+
+    if (overflow)
+        error(EXIT_FAILURE, 0, "%s: Packet does not fit into preallocated output file",
+              __func__);
+
+    return offset;
+}
+
+static void swic_read(int fd, FILE *file)
+{
+    uint64_t elapsed_time = 0;
+    ssize_t sum_bytes;
+
+    if (rx_prealloc_size)
+        sum_bytes = swic_read_mmap(fd, file, &elapsed_time);
+    else if (rx_buf_size)
+        sum_bytes = swic_read_buffered(fd, file, &elapsed_time);
+    else
+        sum_bytes = swic_read_unbuffered(fd, file, &elapsed_time);
+
     if (ioctl(fd, SWICIOC_GET_SPEED, &speed))
         error(EXIT_FAILURE, errno, "%s: Failed to get device speed", __func__);
 
@@ -134,8 +540,7 @@ static void swic_read(int fd, FILE *file)
     print_verbose("Received elapsed time: %f s\n", (double)elapsed_time / 1000000);
     print_verbose("Throughput of receive: %f Mbit/s\n",
                   8 * (double)sum_bytes / (double)elapsed_time);
-
-    free(rx_data);
+    print_io_bounds();
 }
 
 static void help(const char *program_name)
@@ -148,7 +553,16 @@ static void help(const char *program_name)
         puts("Options:");
         puts("    -f arg    filename");
         puts("    -n arg    number of packets");
-        puts("    -v        print verbose");
+        puts("    -v        print verbose\n");
+        puts("Send options (default is to read and send every packet in turn):");
+        puts("    -M        map regular input file and send packets directly from it");
+        puts("    -R arg    read input ahead in a thread into ring of arg packets,");
+        puts("              2 gives double buffering, suitable for pipes and stdin\n");
+        puts("Receive options (default is to write and flush every packet):");
+        puts("    -b arg    aggregate packets and flush output every arg bytes");
+        puts("    -t arg    also flush aggregated packets every arg milliseconds");
+        puts("    -p arg    preallocate arg bytes of output file and receive directly");
+        puts("              into its memory mapping, requires -f");
 }
 
 int main(int argc, char* argv[]) {
@@ -161,11 +575,16 @@ int main(int argc, char* argv[]) {
 
     clock_gettime(CLOCK_MONOTONIC, &start);
 
-    while ((opt = getopt(argc, argv, "f:hn:v")) != -1) {
+    while ((opt = getopt(argc, argv, "b:f:hMn:p:R:t:v")) != -1) {
         switch (opt) {
+            case 'b': rx_buf_size = strtoul(optarg, NULL, 0); break;
             case 'f': filename = optarg; break;
             case 'h': help(argv[0]); return EXIT_SUCCESS;
+            case 'M': tx_mmap = 1; break;
             case 'n': packets = atoi(optarg); break;
+            case 'p': rx_prealloc_size = strtoull(optarg, NULL, 0); break;
+            case 'R': tx_ring_slots = atoi(optarg); break;
+            case 't': rx_flush_ms = atoi(optarg); break;
             case 'v': verbose++; break;
             default: error(EXIT_FAILURE, 0, "Try %s -h for help.", argv[0]);
         }
@@ -190,9 +609,26 @@ int main(int argc, char* argv[]) {
     else
         error(EXIT_FAILURE, 0, "Incorrect operation type");
 
+    if (optype == SWIC_WRITE && (rx_buf_size || rx_flush_ms != -1 || rx_prealloc_size))
+        error(EXIT_FAILURE, 0, "Options -b, -t and -p are supported only for receiving");
+    if (rx_prealloc_size && rx_buf_size)
+        error(EXIT_FAILURE, 0, "Preallocation and buffering are mutually exclusive");
+    if (rx_prealloc_size && !filename)
+        error(EXIT_FAILURE, 0, "Preallocation requires output file");
+    if (rx_flush_ms != -1 && !rx_buf_size)
+        error(EXIT_FAILURE, 0, "Flush interval requires buffer size");
+    if (rx_flush_ms != -1 && rx_flush_ms <= 0)
+        error(EXIT_FAILURE, 0, "Incorrect flush interval");
+    if (optype == SWIC_READ && (tx_mmap || tx_ring_slots))
+        error(EXIT_FAILURE, 0, "Options -M and -R are supported only for sending");
+    if (tx_mmap && tx_ring_slots)
+        error(EXIT_FAILURE, 0, "Mapping and read-ahead ring are mutually exclusive");
+    if (tx_ring_slots < 0)
+        error(EXIT_FAILURE, 0, "Incorrect number of ring slots");
+
     FILE *file = (optype == SWIC_WRITE) ? stdin : stdout;
     if (filename) {
-        char *filemode = (optype == SWIC_WRITE) ? "rb" : "wb";
+        char *filemode = (optype == SWIC_WRITE) ? "rb" : (rx_prealloc_size ? "w+b" : "wb");
         file = fopen(filename, filemode);
         if (!file)
             error(EXIT_FAILURE, errno, "Failed to open %s file", filename);
@@ -15,6 +15,7 @@
 #include <string.h>
 #include <sys/ioctl.h>
 #include <sys/stat.h>
+#include <time.h>
 #include <unistd.h>
 
 #include <linux/elvees-swic.h>
@@ -38,6 +39,9 @@ static struct argp_option options[] = {
     {"speed", 's', "SPEED",   0,
         "Set Link interface speed to SPEED\n"
         "{ 2.4 | 4.8 | 72 | 120 | 168 | 216 | 264 | 312 | 360 | 408 }" },
+    {"watch", 'w', 0,         0,
+        "Poll link state and print its changes with CLOCK_MONOTONIC "
+        "timestamps until interrupted" },
 
     { 0 }
 };
@@ -50,6 +54,7 @@ struct arguments {
     int reset;
     int mtu;
     int tx_speed;
+    int watch;
 };
 
 static void check_device(char *arg, struct argp_state *state)
@@ -62,6 +67,41 @@ static void check_device(char *arg, struct argp_state *state)
         argp_failure(state, 1, 0, "Unsupported device type.");
 }
 
+static const char *link_state_name(enum swic_link_state link_state)
+{
+    switch (link_state) {
+        case LINK_ERROR_RESET: return "ErrorReset";
+        case LINK_ERROR_WAIT: return "ErrorWait";
+        case LINK_READY: return "Ready";
+        case LINK_STARTED: return "Started";
+        case LINK_CONNECTING: return "Connecting";
+        case LINK_RUN: return "Run";
+    }
+
+    return "Unknown";
+}
+
+static void watch_link_state(int fd)
+{
+    enum swic_link_state link_state, prev_state = -1;
+    struct timespec ts;
+
+    while (1) {
+        if (ioctl(fd, SWICIOC_GET_LINK_STATE, &link_state))
+            error(EXIT_FAILURE, errno, "Failed to get link state");
+        clock_gettime(CLOCK_MONOTONIC, &ts);
+
+        if (link_state != prev_state) {
+            printf("%ld.%06ld %s\n", (long)ts.tv_sec, ts.tv_nsec / 1000,
+                   link_state_name(link_state));
+            fflush(stdout);
+            prev_state = link_state;
+        }
+
+        usleep(100);
+    }
+}
+
 static void get_tx_speed(char *arg, struct argp_state *state)
 {
     struct arguments *arguments = state->input;
@@ -118,6 +158,10 @@ static error_t parse_option(int key, char *arg, struct argp_state *state)
         get_tx_speed(arg, state);
         arguments->info = 0;
         break;
+    case 'w':
+        arguments->watch = 1;
+        arguments->info = 0;
+        break;
     case ARGP_KEY_ARG:
         if (state->arg_num == 0) {
             check_device(arg, state);
@@ -151,6 +195,7 @@ int main(int argc, char* argv[])
     arguments.reset = -1;
     arguments.mtu = -1;
     arguments.tx_speed = -1;
+    arguments.watch = 0;
 
     argp_parse(&argp, argc, argv, 0, 0, &arguments);
 
@@ -173,15 +218,7 @@ int main(int argc, char* argv[])
         if (ioctl(fd, SWICIOC_GET_MTU, &mtu))
             error(EXIT_FAILURE, errno, "Failed to get link mtu");
 
-        printf("%s:\tLink state: ", arguments.device);
-        switch(link_state) {
-            case LINK_ERROR_RESET: printf("ErrorReset\n"); break;
-            case LINK_ERROR_WAIT: printf("ErrorWait\n"); break;
-            case LINK_READY: printf("Ready\n"); break;
-            case LINK_STARTED: printf("Started\n"); break;
-            case LINK_CONNECTING: printf("Connecting\n"); break;
-            case LINK_RUN: printf("Run\n"); break;
-        }
+        printf("%s:\tLink state: %s\n", arguments.device, link_state_name(link_state));
         printf("\t\t\tTX speed: %d\n", speed.tx);
         printf("\t\t\tRX speed: %d\n", speed.rx);
         printf("\t\t\tMTU: %lu\n", mtu);
@@ -222,5 +259,8 @@ int main(int argc, char* argv[])
             error(EXIT_FAILURE, errno, "Failed to flush");
     }
 
+    if (arguments.watch)
+        watch_link_state(fd);
+
     return 0;
 }